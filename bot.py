@@ -1,8 +1,17 @@
 import asyncio
+import contextlib
+import html
 import logging
+import json
 import sqlite3
 import os
+import secrets
+import time
+import aiosqlite
+from aiosqlitepool import SQLiteConnectionPool
 from datetime import datetime, timedelta
+from collections import Counter, OrderedDict
+from functools import partial
 from aiogram import Bot, Dispatcher, types, F, Router
 from aiogram.filters import Command, CommandObject
 from aiogram.types import (
@@ -13,8 +22,8 @@ from aiogram.types import (
     Message
 )
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.client.default import DefaultBotProperties
-import hashlib
 
 # Настройка логирования
 logging.basicConfig(
@@ -29,11 +38,19 @@ if not TOKEN:
     logger.error("TELEGRAM_BOT_TOKEN не установлен!")
     raise ValueError("Установите TELEGRAM_BOT_TOKEN в переменных окружения")
 
+# ID администраторов через запятую (ADMIN_IDS или одиночный ADMIN_ID из .env)
+ADMIN_IDS = frozenset(
+    int(x) for x in os.getenv("ADMIN_IDS", os.getenv("ADMIN_ID", "0")).split(",") if x.strip()
+)
+
 bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher()
 router = Router()
 dp.include_router(router)
 
+# Username бота (заполняется при запуске, не меняется за время работы)
+BOT_USERNAME: str = ""
+
 # Партнерские ссылки (только 3 платформы)
 PARTNER_LINKS = {
     'skillbox': 'https://l.skbx.pro/DQLFW6',
@@ -58,206 +75,347 @@ COMMISSIONS = {
 # База данных
 DB_NAME = "courses_bot.db"
 
-def get_db_connection():
-    """Создание соединения с БД"""
-    conn = sqlite3.connect(DB_NAME, check_same_thread=False)
+# Настройки SQLite для каждого соединения
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Размер кеша подготовленных выражений на соединение
+DB_CACHED_STATEMENTS = 256
+
+# Число попыток сгенерировать уникальный реф-код
+REF_CODE_ATTEMPTS = 5
+
+# Интервал принудительного checkpoint WAL (секунды)
+WAL_CHECKPOINT_INTERVAL = 300
+
+# Буферизация кликов: размер очереди и интервал записи в БД (секунды)
+CLICK_BUFFER_SIZE = 10000
+CLICK_FLUSH_INTERVAL = 0.25
+
+# Интервал записи отметок активности в БД (секунды)
+ACTIVITY_FLUSH_INTERVAL = 5
+
+async def _connection_factory():
+    """Создание соединения для пула"""
+    conn = await aiosqlite.connect(DB_NAME, cached_statements=DB_CACHED_STATEMENTS)
     conn.row_factory = sqlite3.Row
+    for pragma in DB_PRAGMAS:
+        await conn.execute(pragma)
+    await conn.commit()
     return conn
 
-def init_db():
-    """Инициализация базы данных"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Таблица пользователей
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            telegram_id INTEGER UNIQUE NOT NULL,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            clicks_count INTEGER DEFAULT 0,
-            ref_code TEXT UNIQUE,
-            referrer_id INTEGER,
-            last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+# Пул долгоживущих соединений (создается при запуске бота)
+pool: SQLiteConnectionPool = None
+checkpoint_task: asyncio.Task = None
+click_flush_task: asyncio.Task = None
+activity_flush_task: asyncio.Task = None
+
+# Буфер кликов: (telegram_id, platform, course_id)
+click_buffer: asyncio.Queue = asyncio.Queue(maxsize=CLICK_BUFFER_SIZE)
+# Клики, забранные из буфера, но еще не записанные в БД
+clicks_in_flight: list = []
+# Сигнал остановки цикла сброса кликов (запущенную запись не прерываем)
+click_flush_stop = asyncio.Event()
+
+# Последняя активность пользователей, еще не записанная в БД: telegram_id -> unix time
+pending_activity: dict = {}
+
+async def wal_checkpoint_loop():
+    """Периодический checkpoint, чтобы WAL-файл не разрастался"""
+    while True:
+        await asyncio.sleep(WAL_CHECKPOINT_INTERVAL)
+        try:
+            async with pool.connection() as conn:
+                await conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except Exception as e:
+            logger.error("Ошибка checkpoint WAL: %s", e)
+
+async def on_startup():
+    """Действия при запуске бота"""
+    global pool, checkpoint_task, click_flush_task, activity_flush_task, BOT_USERNAME
+    pool = SQLiteConnectionPool(_connection_factory, pool_size=8)
+    BOT_USERNAME = (await bot.get_me()).username
     
-    # Таблица кликов
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS clicks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            platform TEXT NOT NULL,
-            course_id INTEGER,
-            clicked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-        )
-    ''')
-    
-    # Таблица курсов (кеш)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS courses_cache (
-            id INTEGER PRIMARY KEY,
-            title TEXT NOT NULL,
-            platform TEXT NOT NULL,
-            category TEXT NOT NULL,
-            data TEXT NOT NULL,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    # Инициализация БД
+    await init_db()
     
-    # Индексы для оптимизации
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_telegram ON users(telegram_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_clicks_user ON clicks(user_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_clicks_platform ON clicks(platform)')
+    async with pool.connection() as conn:
+        rows = await conn.execute_fetchall("PRAGMA journal_mode")
+    logger.info("Режим журнала SQLite: %s", rows[0][0])
     
-    conn.commit()
-    conn.close()
-    logger.info("База данных инициализирована")
+    checkpoint_task = asyncio.create_task(wal_checkpoint_loop())
+    click_flush_task = asyncio.create_task(click_flush_loop())
+    activity_flush_task = asyncio.create_task(activity_flush_loop())
 
-def add_user(telegram_id: int, username: str, first_name: str, last_name: str, referrer_id: int = None):
-    """Добавление пользователя в БД"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # Генерация реферального кода
-        ref_code = hashlib.md5(f"{telegram_id}{datetime.now().timestamp()}".encode()).hexdigest()[:8]
+async def stop_task(task: asyncio.Task):
+    """Отмена фоновой задачи с ожиданием ее завершения"""
+    if task is None:
+        return
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+
+async def on_shutdown():
+    """Действия при остановке бота"""
+    await stop_task(checkpoint_task)
+    # Даем текущему сбросу кликов завершиться: отмена во время commit привела бы к повторной записи
+    click_flush_stop.set()
+    if click_flush_task is not None:
+        await click_flush_task
+    await stop_task(activity_flush_task)
+    if pool is not None:
+        # Дописываем то, что осталось в буферах (кликов может быть больше одной пачки)
+        while clicks_in_flight or not click_buffer.empty():
+            pending = len(clicks_in_flight) + click_buffer.qsize()
+            await flush_clicks()
+            if len(clicks_in_flight) + click_buffer.qsize() >= pending:
+                break
+        await flush_activity()
+        await pool.close()
+        logger.info("Пул соединений с БД закрыт")
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+async def init_db():
+    """Инициализация базы данных"""
+    async with pool.connection() as conn:
+        # Таблица пользователей
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER UNIQUE NOT NULL,
+                username TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                clicks_count INTEGER DEFAULT 0,
+                ref_code TEXT UNIQUE,
+                referrer_id INTEGER,
+                last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Таблица кликов
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS clicks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                platform TEXT NOT NULL,
+                course_id INTEGER,
+                clicked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                click_date TEXT GENERATED ALWAYS AS (DATE(clicked_at)) VIRTUAL,
+                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+            )
+        ''')
         
-        cursor.execute('''
-            INSERT OR IGNORE INTO users 
-            (telegram_id, username, first_name, last_name, ref_code, referrer_id, last_active)
-            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (telegram_id, username, first_name, last_name, ref_code, referrer_id))
+        # Миграция: дата клика для группировки по дням
+        columns = {row['name'] for row in await conn.execute_fetchall('PRAGMA table_xinfo(clicks)')}
+        if 'click_date' not in columns:
+            await conn.execute('''
+                ALTER TABLE clicks
+                ADD COLUMN click_date TEXT GENERATED ALWAYS AS (DATE(clicked_at)) VIRTUAL
+            ''')
         
-        if cursor.rowcount > 0:
-            logger.info(f"Новый пользователь: {telegram_id} ({username})")
+        # Индексы для оптимизации
+        await conn.execute('CREATE INDEX IF NOT EXISTS idx_users_telegram ON users(telegram_id)')
+        await conn.execute('CREATE INDEX IF NOT EXISTS idx_users_last_active ON users(last_active)')
+        await conn.execute('CREATE INDEX IF NOT EXISTS idx_clicks_user_time ON clicks(user_id, clicked_at DESC)')
+        await conn.execute('CREATE INDEX IF NOT EXISTS idx_clicks_user_platform ON clicks(user_id, platform)')
+        await conn.execute('CREATE INDEX IF NOT EXISTS idx_clicks_platform ON clicks(platform)')
+        await conn.execute('CREATE INDEX IF NOT EXISTS idx_clicks_date ON clicks(click_date)')
+        # Покрывается idx_clicks_user_time
+        await conn.execute('DROP INDEX IF EXISTS idx_clicks_user')
+        # Не используется запросами
+        await conn.execute('DROP INDEX IF EXISTS idx_clicks_clicked_at')
         
-        conn.commit()
+        # Обновляем статистику для планировщика запросов
+        await conn.execute('ANALYZE')
+        
+        await conn.commit()
+    logger.info("База данных инициализирована")
+
+async def add_user(telegram_id: int, username: str, first_name: str, last_name: str, referrer_id: int = None):
+    """Добавление пользователя в БД"""
+    try:
+        async with pool.connection() as conn:
+            for _ in range(REF_CODE_ATTEMPTS):
+                # Генерация реферального кода (8 символов)
+                ref_code = secrets.token_urlsafe(6)
+                try:
+                    cursor = await conn.execute('''
+                        INSERT INTO users 
+                        (telegram_id, username, first_name, last_name, ref_code, referrer_id, last_active)
+                        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                        ON CONFLICT(telegram_id) DO NOTHING
+                    ''', (telegram_id, username, first_name, last_name, ref_code, referrer_id))
+                except sqlite3.IntegrityError:
+                    # Совпал ref_code — генерируем новый
+                    continue
+                break
+            else:
+                raise RuntimeError("не удалось сгенерировать уникальный реф-код")
+            
+            if cursor.rowcount > 0:
+                logger.info("Новый пользователь: %s (%s)", telegram_id, username)
+            
+            await conn.commit()
         return ref_code
     except Exception as e:
-        logger.error(f"Ошибка добавления пользователя: {e}")
+        logger.error("Ошибка добавления пользователя: %s", e)
         return None
-    finally:
-        conn.close()
 
 def update_user_activity(telegram_id: int):
-    """Обновление времени последней активности"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    """Отметка активности пользователя (запись в БД пачками)"""
+    pending_activity[telegram_id] = time.time()
+
+async def flush_activity():
+    """Запись накопленных отметок активности одной транзакцией"""
+    if not pending_activity:
+        return
+    
+    batch = [(ts, telegram_id) for telegram_id, ts in pending_activity.items()]
     
     try:
-        cursor.execute('''
-            UPDATE users 
-            SET last_active = CURRENT_TIMESTAMP 
-            WHERE telegram_id = ?
-        ''', (telegram_id,))
-        conn.commit()
+        async with pool.connection() as conn:
+            await conn.executemany('''
+                UPDATE users 
+                SET last_active = MAX(COALESCE(last_active, ''), datetime(?, 'unixepoch')) 
+                WHERE telegram_id = ?
+            ''', batch)
+            await conn.commit()
     except Exception as e:
-        logger.error(f"Ошибка обновления активности: {e}")
-    finally:
-        conn.close()
+        # Отметки остаются в pending_activity и будут записаны при следующем сбросе
+        logger.error("Ошибка обновления активности (%s шт.): %s", len(batch), e)
+        return
+    
+    # Убираем записанные отметки, если пользователь не успел проявить новую активность
+    for ts, telegram_id in batch:
+        if pending_activity.get(telegram_id) == ts:
+            del pending_activity[telegram_id]
+
+async def activity_flush_loop():
+    """Периодический сброс отметок активности"""
+    while True:
+        await asyncio.sleep(ACTIVITY_FLUSH_INTERVAL)
+        await flush_activity()
 
-def add_click(telegram_id: int, platform: str, course_id: int = None):
-    """Добавление клика в БД"""
+async def add_click(telegram_id: int, platform: str, course_id: int = None):
+    """Добавление клика в буфер (запись в БД пачками)"""
     if platform not in PARTNER_LINKS:
-        logger.warning(f"Неизвестная платформа: {platform}")
+        logger.warning("Неизвестная платформа: %s", platform)
+        return
+    
+    try:
+        click_buffer.put_nowait((telegram_id, platform, course_id))
+    except asyncio.QueueFull:
+        # Не задерживаем пользователя из-за аналитики: при переполненном буфере клик теряется
+        logger.warning("Буфер кликов переполнен, клик отброшен: user=%s, platform=%s, course=%s",
+                       telegram_id, platform, course_id)
+        return
+    logger.info("Клик поставлен в очередь: user=%s, platform=%s, course=%s", telegram_id, platform, course_id)
+
+async def flush_clicks():
+    """Запись накопленных кликов в БД одной транзакцией"""
+    while len(clicks_in_flight) < CLICK_BUFFER_SIZE and not click_buffer.empty():
+        clicks_in_flight.append(click_buffer.get_nowait())
+    
+    if not clicks_in_flight:
         return
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    batch = list(clicks_in_flight)
+    
+    # Счетчики кликов по пользователям
+    clicks_per_user = Counter(telegram_id for telegram_id, _, _ in batch)
     
     try:
-        # Получаем ID пользователя
-        cursor.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,))
-        user = cursor.fetchone()
-        
-        if not user:
-            logger.warning(f"Пользователь {telegram_id} не найден в БД")
-            return
-        
-        user_id = user['id']
-        
-        # Добавляем клик
-        cursor.execute('''
-            INSERT INTO clicks (user_id, platform, course_id)
-            VALUES (?, ?, ?)
-        ''', (user_id, platform, course_id))
-        
-        # Обновляем счетчик кликов
-        cursor.execute('''
-            UPDATE users 
-            SET clicks_count = clicks_count + 1,
-                last_active = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (user_id,))
-        
-        conn.commit()
-        logger.info(f"Клик добавлен: user={telegram_id}, platform={platform}, course={course_id}")
+        async with pool.connection() as conn:
+            await conn.execute("BEGIN IMMEDIATE")
+            # ID пользователя берем подзапросом; клики неизвестных пользователей отбрасываются
+            changes_before = conn.total_changes
+            await conn.executemany('''
+                INSERT INTO clicks (user_id, platform, course_id)
+                SELECT id, ?, ? FROM users WHERE telegram_id = ?
+            ''', [(platform, course_id, telegram_id) for telegram_id, platform, course_id in batch])
+            inserted = conn.total_changes - changes_before
+            
+            # Обновляем счетчики кликов
+            await conn.executemany('''
+                UPDATE users 
+                SET clicks_count = clicks_count + ?,
+                    last_active = CURRENT_TIMESTAMP
+                WHERE telegram_id = ?
+            ''', [(count, telegram_id) for telegram_id, count in clicks_per_user.items()])
+            
+            await conn.commit()
     except Exception as e:
-        logger.error(f"Ошибка добавления клика: {e}")
-    finally:
-        conn.close()
+        # Клики остаются в clicks_in_flight и будут записаны при следующем сбросе
+        logger.error("Ошибка записи кликов (%s шт.): %s", len(batch), e)
+        return
+    
+    # Убираем только записанные клики
+    del clicks_in_flight[:len(batch)]
+    
+    logger.info("Записано кликов: %s", inserted)
+    if inserted < len(batch):
+        logger.warning("Пропущено кликов от неизвестных пользователей: %s", len(batch) - inserted)
 
-def get_user_stats(telegram_id: int) -> dict:
+async def click_flush_loop():
+    """Периодический сброс буфера кликов"""
+    while not click_flush_stop.is_set():
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(click_flush_stop.wait(), CLICK_FLUSH_INTERVAL)
+        await flush_clicks()
+
+async def get_user_stats(telegram_id: int) -> dict:
     """Получение статистики пользователя"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
-        # Основная информация
-        cursor.execute('''
-            SELECT u.*, 
-                   COUNT(DISTINCT c.platform) as platforms_count,
-                   COUNT(c.id) as total_clicks
-            FROM users u
-            LEFT JOIN clicks c ON u.id = c.user_id
-            WHERE u.telegram_id = ?
-            GROUP BY u.id
-        ''', (telegram_id,))
-        
-        user_data = cursor.fetchone()
+        async with pool.connection() as conn:
+            # Профиль, клики по платформам и последние клики одним запросом
+            user_rows = await conn.execute_fetchall('''
+                WITH u AS (
+                    SELECT * FROM users WHERE telegram_id = ?
+                ),
+                pc AS (
+                    SELECT platform, COUNT(*) as clicks
+                    FROM clicks
+                    WHERE user_id = (SELECT id FROM u)
+                    GROUP BY platform
+                    ORDER BY clicks DESC
+                ),
+                rc AS (
+                    SELECT platform, clicked_at
+                    FROM clicks
+                    WHERE user_id = (SELECT id FROM u)
+                    ORDER BY clicked_at DESC
+                    LIMIT 5
+                )
+                SELECT u.*,
+                       (SELECT COUNT(*) FROM pc) as platforms_count,
+                       (SELECT COALESCE(SUM(clicks), 0) FROM pc) as total_clicks,
+                       (SELECT json_group_array(json_object('platform', platform, 'clicks', clicks)) FROM pc) as platforms_json,
+                       (SELECT json_group_array(json_object('platform', platform, 'clicked_at', clicked_at)) FROM rc) as recent_json
+                FROM u
+            ''', (telegram_id,))
         
-        if not user_data:
+        if not user_rows:
             return None
         
-        # Клики по платформам
-        cursor.execute('''
-            SELECT platform, COUNT(*) as clicks
-            FROM clicks c
-            JOIN users u ON c.user_id = u.id
-            WHERE u.telegram_id = ?
-            GROUP BY platform
-            ORDER BY clicks DESC
-        ''', (telegram_id,))
-        
-        platforms_clicks = cursor.fetchall()
-        
-        # Последние клики
-        cursor.execute('''
-            SELECT c.platform, c.clicked_at
-            FROM clicks c
-            JOIN users u ON c.user_id = u.id
-            WHERE u.telegram_id = ?
-            ORDER BY c.clicked_at DESC
-            LIMIT 5
-        ''', (telegram_id,))
-        
-        recent_clicks = cursor.fetchall()
-        
+        user_data = dict(user_rows[0])
         return {
-            'user': dict(user_data),
-            'platforms_clicks': [dict(row) for row in platforms_clicks],
-            'recent_clicks': [dict(row) for row in recent_clicks]
+            'platforms_clicks': json.loads(user_data.pop('platforms_json')),
+            'recent_clicks': json.loads(user_data.pop('recent_json')),
+            'user': user_data
         }
     except Exception as e:
-        logger.error(f"Ошибка получения статистики: {e}")
+        logger.error("Ошибка получения статистики: %s", e)
         return None
-    finally:
-        conn.close()
 
 # Данные о курсах (оптимизированные)
 COURSES_DATA = {
@@ -381,31 +539,16 @@ COURSES_DATA = {
     ]
 }
 
-@dp.message(Command("start"))
-async def start_command(message: Message, command: CommandObject = None):
-    """Обработчик команды /start"""
-    user_id = message.from_user.id
-    username = message.from_user.username or ""
-    first_name = message.from_user.first_name or "Пользователь"
-    last_name = message.from_user.last_name or ""
-    
-    # Обработка реферальной ссылки
-    referrer_id = None
-    if command and command.args:
-        if command.args.startswith('ref'):
-            try:
-                referrer_id = int(command.args[3:])
-                logger.info(f"Реферальный переход: {user_id} от {referrer_id}")
-            except ValueError:
-                logger.warning(f"Некорректный реферальный код: {command.args}")
-    
-    # Добавляем/обновляем пользователя
-    ref_code = add_user(user_id, username, first_name, last_name, referrer_id)
-    update_user_activity(user_id)
-    
-    # Приветственное сообщение
-    welcome_text = f"""
-🎓 <b>Привет, {first_name}!</b>
+# Индексы по курсам (данные статичны, строим один раз)
+COURSE_BY_ID = {c['id']: c for cat in COURSES_DATA.values() for c in cat}
+COURSES_BY_PLATFORM = {}
+for cat in COURSES_DATA.values():
+    for c in cat:
+        COURSES_BY_PLATFORM.setdefault(c['platform'], []).append(c)
+
+# Статичные тексты и клавиатуры (собираются один раз при загрузке)
+WELCOME_TEMPLATE = f"""
+🎓 <b>Привет, {{first_name}}!</b>
 
 Я — бот-куратор курсов по IT и digital.
 Помогу выбрать лучшие курсы с проверенными отзывами.
@@ -419,37 +562,31 @@ async def start_command(message: Message, command: CommandObject = None):
 
 👇 <b>Выберите категорию:</b>
     """
-    
-    # Основная клавиатура
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [
-                KeyboardButton(text="💻 Программирование"),
-                KeyboardButton(text="🎨 Дизайн")
-            ],
-            [
-                KeyboardButton(text="📈 Маркетинг"),
-                KeyboardButton(text="📊 Аналитика")
-            ],
-            [
-                KeyboardButton(text="🔍 Подобрать курс"),
-                KeyboardButton(text="📊 Моя статистика")
-            ],
-            [
-                KeyboardButton(text="ℹ️ О боте"),
-                KeyboardButton(text="🤝 Партнерка")
-            ]
+
+MAIN_MENU_KB = ReplyKeyboardMarkup(
+    keyboard=[
+        [
+            KeyboardButton(text="💻 Программирование"),
+            KeyboardButton(text="🎨 Дизайн")
         ],
-        resize_keyboard=True,
-        input_field_placeholder="Выберите действие..."
-    )
-    
-    await message.answer(welcome_text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+        [
+            KeyboardButton(text="📈 Маркетинг"),
+            KeyboardButton(text="📊 Аналитика")
+        ],
+        [
+            KeyboardButton(text="🔍 Подобрать курс"),
+            KeyboardButton(text="📊 Моя статистика")
+        ],
+        [
+            KeyboardButton(text="ℹ️ О боте"),
+            KeyboardButton(text="🤝 Партнерка")
+        ]
+    ],
+    resize_keyboard=True,
+    input_field_placeholder="Выберите действие..."
+)
 
-@dp.message(Command("help"))
-async def help_command(message: Message):
-    """Команда помощи"""
-    help_text = """
+HELP_TEXT = """
 <b>📚 Доступные команды:</b>
 
 /start — Главное меню
@@ -473,100 +610,52 @@ async def help_command(message: Message):
 
 <i>Есть вопросы? Напишите нам!</i>
     """
-    
-    await message.answer(help_text, parse_mode=ParseMode.HTML)
-
-@dp.message(F.text == "💻 Программирование")
-async def programming_category(message: Message):
-    """Курсы по программированию"""
-    await show_category(message, 'programming', "💻 <b>Курсы по программированию</b>")
 
-@dp.message(F.text == "🎨 Дизайн")
-async def design_category(message: Message):
-    """Курсы по дизайну"""
-    await show_category(message, 'design', "🎨 <b>Курсы по дизайну</b>")
-
-@dp.message(F.text == "📈 Маркетинг")
-async def marketing_category(message: Message):
-    """Курсы по маркетингу"""
-    await show_category(message, 'marketing', "📈 <b>Курсы по маркетингу</b>")
-
-@dp.message(F.text == "📊 Аналитика")
-async def analytics_category(message: Message):
-    """Курсы по аналитике"""
-    await show_category(message, 'analytics', "📊 <b>Курсы по аналитике</b>")
+BACK_TO_MENU_ROW = [
+    InlineKeyboardButton(text="🔙 Назад", callback_data="menu_back")
+]
+
+COURSE_DETAIL_FOOTER = [
+    InlineKeyboardButton(text="🔙 Назад к категориям", callback_data="category_back"),
+    InlineKeyboardButton(text="🏠 В меню", callback_data="menu_back")
+]
+
+# Заголовки категорий
+CATEGORY_TITLES = {
+    'programming': "💻 <b>Курсы по программированию</b>",
+    'design': "🎨 <b>Курсы по дизайну</b>",
+    'marketing': "📈 <b>Курсы по маркетингу</b>",
+    'analytics': "📊 <b>Курсы по аналитике</b>"
+}
 
-async def show_category(message: Message, category: str, title: str):
-    """Показать курсы в категории"""
-    update_user_activity(message.from_user.id)
-    
-    courses = COURSES_DATA.get(category, [])
-    
+# Тексты и клавиатуры списков курсов по категориям
+CATEGORY_TEXTS = {}
+CATEGORY_KEYBOARDS = {}
+for cat, courses in COURSES_DATA.items():
     if not courses:
-        await message.answer("😔 Курсы в этой категории временно недоступны.")
-        return
-    
-    # Формируем список курсов
-    text = f"{title}\n\n"
-    keyboard_buttons = []
-    
-    for course in courses:
-        platform_name = PLATFORM_NAMES.get(course['platform'], course['platform'])
-        button_text = f"{course['title']} ({platform_name})"
-        
-        keyboard_buttons.append([
+        continue
+    rows = [
+        [
             InlineKeyboardButton(
-                text=button_text,
-                callback_data=f"course_{course['id']}"
+                text=f"{c['title']} ({PLATFORM_NAMES.get(c['platform'], c['platform'])})",
+                callback_data=f"course_{c['id']}"
             )
-        ])
-    
-    # Добавляем кнопку назад
-    keyboard_buttons.append([
+        ]
+        for c in courses
+    ]
+    rows.append([
         InlineKeyboardButton(text="🔙 Назад в меню", callback_data="menu_back")
     ])
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-    text += "<i>Выберите курс для подробной информации:</i>"
-    
-    await message.answer(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+    CATEGORY_KEYBOARDS[cat] = InlineKeyboardMarkup(inline_keyboard=rows)
+    CATEGORY_TEXTS[cat] = f"{CATEGORY_TITLES[cat]}\n\n<i>Выберите курс для подробной информации:</i>"
 
-@dp.callback_query(F.data.startswith("course_"))
-async def show_course_detail(callback: types.CallbackQuery):
-    """Показать детальную информацию о курсе"""
-    try:
-        course_id = int(callback.data.split("_")[1])
-    except (ValueError, IndexError):
-        await callback.answer("❌ Ошибка загрузки курса", show_alert=True)
-        return
-    
-    # Ищем курс
-    course = None
-    for category in COURSES_DATA.values():
-        for c in category:
-            if c['id'] == course_id:
-                course = c
-                break
-        if course:
-            break
-    
-    if not course:
-        await callback.answer("❌ Курс не найден", show_alert=True)
-        return
-    
-    update_user_activity(callback.from_user.id)
-    
-    # Регистрируем клик
-    add_click(callback.from_user.id, course['platform'], course_id)
-    
-    # Получаем данные
+def render_course_detail(course: dict) -> str:
+    """Текст карточки курса"""
     platform = course['platform']
     platform_name = PLATFORM_NAMES.get(platform, platform)
     commission = COMMISSIONS.get(platform, "15-30%")
-    partner_link = PARTNER_LINKS.get(platform, "#")
     
-    # Формируем сообщение
-    text = f"""
+    return f"""
 🎓 <b>{course['title']}</b>
 🏢 <i>Платформа: {platform_name}</i>
 ⭐ <b>Рейтинг: {course['rating']}</b>
@@ -585,9 +674,13 @@ async def show_course_detail(callback: types.CallbackQuery):
 
 💼 <b>Партнерская комиссия:</b> {commission}
     """
-    
-    # Клавиатура действий
-    keyboard_buttons = [
+
+# Карточки курсов не содержат пользовательских данных — рендерим заранее
+COURSE_TEXTS = {course_id: render_course_detail(c) for course_id, c in COURSE_BY_ID.items()}
+
+# Клавиатура карточки курса зависит только от платформы
+COURSE_DETAIL_KBS = {
+    platform: InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
                 text="🌐 Перейти на сайт курса",
@@ -600,114 +693,60 @@ async def show_course_detail(callback: types.CallbackQuery):
                 callback_data=f"similar_{platform}"
             )
         ],
+        COURSE_DETAIL_FOOTER
+    ])
+    for platform, partner_link in PARTNER_LINKS.items()
+}
+
+# Похожие курсы по платформам (не более 5)
+SIMILAR_KBS = {
+    platform: InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="🔙 Назад к категориям", callback_data="category_back"),
-            InlineKeyboardButton(text="🏠 В меню", callback_data="menu_back")
+            InlineKeyboardButton(
+                text=course['title'],
+                callback_data=f"course_{course['id']}"
+            )
         ]
-    ]
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-    
-    try:
-        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-    except:
-        await callback.message.answer(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-    
-    await callback.answer()
+        for course in courses[:5]
+    ] + [BACK_TO_MENU_ROW])
+    for platform, courses in COURSES_BY_PLATFORM.items()
+}
 
-@dp.message(F.text == "🔍 Подобрать курс")
-async def course_finder(message: Message):
-    """Подбор курса по параметрам"""
-    update_user_activity(message.from_user.id)
-    
-    text = """
+FINDER_TEXT = """
 🎯 <b>Подбор идеального курса</b>
 
 Ответьте на 3 вопроса, и я подберу курсы именно для вас:
 
 <b>1. Какое направление вас интересует?</b>
     """
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="💻 Программирование", callback_data="finder_prog"),
-            InlineKeyboardButton(text="🎨 Дизайн", callback_data="finder_design")
-        ],
-        [
-            InlineKeyboardButton(text="📈 Маркетинг", callback_data="finder_marketing"),
-            InlineKeyboardButton(text="📊 Аналитика", callback_data="finder_analytics")
-        ],
-        [
-            InlineKeyboardButton(text="❓ Не знаю, помогите", callback_data="finder_help"),
-            InlineKeyboardButton(text="🔙 Назад", callback_data="menu_back")
-        ]
-    ])
-    
-    await message.answer(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-
-@dp.message(F.text == "📊 Моя статистика")
-async def my_stats(message: Message):
-    """Статистика пользователя"""
-    user_id = message.from_user.id
-    update_user_activity(user_id)
-    
-    stats = get_user_stats(user_id)
-    
-    if not stats or not stats['user']:
-        text = "📊 <b>Ваша статистика</b>\n\nВы еще не совершали активных действий."
-    else:
-        user_data = stats['user']
-        platforms = stats['platforms_clicks']
-        
-        text = f"""
-📊 <b>Ваша статистика</b>
-
-👤 <b>Пользователь:</b> {user_data['first_name']}
-📅 <b>Зарегистрирован:</b> {user_data['registered_at'][:10]}
-🔗 <b>Ваш реф-код:</b> <code>{user_data['ref_code']}</code>
-
-📈 <b>Активность:</b>
-• Всего переходов: <b>{user_data['clicks_count']}</b>
-• Активных платформ: <b>{len(platforms)}</b>
-
-<b>Переходы по платформам:</b>
-"""
-        
-        for platform in platforms:
-            platform_name = PLATFORM_NAMES.get(platform['platform'], platform['platform'])
-            text += f"• {platform_name}: {platform['clicks']} переходов\n"
-        
-        if user_data['referrer_id']:
-            text += f"\n🤝 <b>Вас пригласил:</b> пользователь #{user_data['referrer_id']}"
-        
-        text += f"""
 
-💼 <b>Ваш заработок:</b>
-Приглашено друзей: <b>0</b>
-Доступно к выводу: <b>0 ₽</b>
+FINDER_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(text="💻 Программирование", callback_data="finder_prog"),
+        InlineKeyboardButton(text="🎨 Дизайн", callback_data="finder_design")
+    ],
+    [
+        InlineKeyboardButton(text="📈 Маркетинг", callback_data="finder_marketing"),
+        InlineKeyboardButton(text="📊 Аналитика", callback_data="finder_analytics")
+    ],
+    [
+        InlineKeyboardButton(text="❓ Не знаю, помогите", callback_data="finder_help"),
+        InlineKeyboardButton(text="🔙 Назад", callback_data="menu_back")
+    ]
+])
 
-<i>Приглашайте друзей по реферальной ссылке!</i>
-"""
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="📋 Моя реф-ссылка", callback_data="my_ref_link"),
-            InlineKeyboardButton(text="💳 Вывод средств", callback_data="withdraw")
-        ],
-        [
-            InlineKeyboardButton(text="🔄 Обновить", callback_data="refresh_stats"),
-            InlineKeyboardButton(text="🔙 Назад", callback_data="menu_back")
-        ]
-    ])
-    
-    await message.answer(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+STATS_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(text="📋 Моя реф-ссылка", callback_data="my_ref_link"),
+        InlineKeyboardButton(text="💳 Вывод средств", callback_data="withdraw")
+    ],
+    [
+        InlineKeyboardButton(text="🔄 Обновить", callback_data="refresh_stats"),
+        InlineKeyboardButton(text="🔙 Назад", callback_data="menu_back")
+    ]
+])
 
-@dp.message(F.text == "ℹ️ О боте")
-async def about_bot(message: Message):
-    """Информация о боте"""
-    update_user_activity(message.from_user.id)
-    
-    text = f"""
+ABOUT_TEXT = f"""
 🤖 <b>О боте-кураторе</b>
 
 <b>Наша миссия:</b>
@@ -735,34 +774,22 @@ async def about_bot(message: Message):
 
 <i>Бот работает на энтузиазме ❤️</i>
     """
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="📢 Наш канал", url="https://t.me/your_channel"),
-            InlineKeyboardButton(text="💬 Чат поддержки", url="https://t.me/your_support")
-        ],
-        [
-            InlineKeyboardButton(text="🔙 Назад", callback_data="menu_back")
-        ]
-    ])
-    
-    await message.answer(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
 
-@dp.message(F.text == "🤝 Партнерка")
-async def partner_program(message: Message):
-    """Партнерская программа"""
-    update_user_activity(message.from_user.id)
-    
-    stats = get_user_stats(message.from_user.id)
-    ref_code = stats['user']['ref_code'] if stats and stats['user'] else "Ошибка"
-    
-    text = f"""
+ABOUT_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(text="📢 Наш канал", url="https://t.me/your_channel"),
+        InlineKeyboardButton(text="💬 Чат поддержки", url="https://t.me/your_support")
+    ],
+    BACK_TO_MENU_ROW
+])
+
+PARTNER_TEMPLATE = """
 🤝 <b>Партнерская программа</b>
 
 Приглашайте друзей и получайте <b>10% от нашей комиссии</b> с их покупок!
 
 <b>Ваша реферальная ссылка:</b>
-<code>https://t.me/{(await bot.get_me()).username}?start=ref{message.from_user.id}</code>
+<code>https://t.me/{bot_username}?start=ref{user_id}</code>
 
 <b>Или код для ручного ввода:</b>
 <code>{ref_code}</code>
@@ -786,49 +813,224 @@ async def partner_program(message: Message):
 
 <i>Начните приглашать друзей уже сегодня!</i>
     """
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="📋 Скопировать ссылку", callback_data="copy_ref_link"),
-            InlineKeyboardButton(text="📊 Мои рефералы", callback_data="my_refs")
-        ],
+
+PARTNER_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(text="📋 Скопировать ссылку", callback_data="copy_ref_link"),
+        InlineKeyboardButton(text="📊 Мои рефералы", callback_data="my_refs")
+    ],
+    [
+        InlineKeyboardButton(text="💰 Баланс", callback_data="balance"),
+        InlineKeyboardButton(text="💳 Вывод", callback_data="withdraw")
+    ],
+    BACK_TO_MENU_ROW
+])
+
+ADMIN_HEADER = "\n<b>📊 АДМИН-ПАНЕЛЬ</b>\n\n"
+ADMIN_PLATFORMS_HEADER = "\n<b>Клики по платформам:</b>\n"
+ADMIN_DAILY_HEADER = "\n<b>Клики за 7 дней:</b>\n"
+
+# Названия платформ, подготовленные для HTML-разметки
+PLATFORM_NAMES_HTML = {k: html.escape(v) for k, v in PLATFORM_NAMES.items()}
+
+ADMIN_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_refresh"),
+        InlineKeyboardButton(text="📥 Экспорт", callback_data="admin_export")
+    ],
+    [
+        InlineKeyboardButton(text="✉️ Рассылка", callback_data="admin_broadcast"),
+        InlineKeyboardButton(text="🚪 Выход", callback_data="menu_back")
+    ]
+])
+
+CATEGORIES_TEXT = "👇 <b>Выберите категорию курсов:</b>"
+
+CATEGORIES_KB = ReplyKeyboardMarkup(
+    keyboard=[
         [
-            InlineKeyboardButton(text="💰 Баланс", callback_data="balance"),
-            InlineKeyboardButton(text="💳 Вывод", callback_data="withdraw")
+            KeyboardButton(text="💻 Программирование"),
+            KeyboardButton(text="🎨 Дизайн")
         ],
         [
-            InlineKeyboardButton(text="🔙 Назад", callback_data="menu_back")
+            KeyboardButton(text="📈 Маркетинг"),
+            KeyboardButton(text="📊 Аналитика")
         ]
-    ])
+    ],
+    resize_keyboard=True
+)
+
+@dp.message(Command("start"))
+async def start_command(message: Message, command: CommandObject = None):
+    """Обработчик команды /start"""
+    user_id = message.from_user.id
+    username = message.from_user.username or ""
+    first_name = message.from_user.first_name or "Пользователь"
+    last_name = message.from_user.last_name or ""
     
-    await message.answer(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+    # Обработка реферальной ссылки
+    referrer_id = None
+    if command and command.args:
+        if command.args.startswith('ref'):
+            try:
+                referrer_id = int(command.args[3:])
+                logger.info("Реферальный переход: %s от %s", user_id, referrer_id)
+            except ValueError:
+                logger.warning("Некорректный реферальный код: %s", command.args)
+    
+    # Добавляем/обновляем пользователя
+    ref_code = await add_user(user_id, username, first_name, last_name, referrer_id)
+    update_user_activity(user_id)
+    
+    # Приветственное сообщение
+    welcome_text = WELCOME_TEMPLATE.format(first_name=first_name)
+    await message.answer(welcome_text, reply_markup=MAIN_MENU_KB, parse_mode=ParseMode.HTML)
+
+@dp.message(Command("help"))
+async def help_command(message: Message):
+    """Команда помощи"""
+    await message.answer(HELP_TEXT, parse_mode=ParseMode.HTML)
+
+async def show_category(message: Message, category: str):
+    """Показать курсы в категории"""
+    update_user_activity(message.from_user.id)
+    
+    keyboard = CATEGORY_KEYBOARDS.get(category)
+    
+    if not keyboard:
+        await message.answer("😔 Курсы в этой категории временно недоступны.")
+        return
+    
+    await message.answer(CATEGORY_TEXTS[category], reply_markup=keyboard, parse_mode=ParseMode.HTML)
+
+async def edit_or_answer(callback: types.CallbackQuery, text: str, reply_markup: InlineKeyboardMarkup):
+    """Редактирование сообщения, при невозможности — отправка нового"""
+    try:
+        await callback.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+    except TelegramBadRequest as e:
+        # Содержимое не изменилось — повторно отправлять нечего
+        if "message is not modified" in e.message:
+            return
+        await callback.message.answer(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+
+@dp.callback_query(F.data.startswith("course_"))
+async def show_course_detail(callback: types.CallbackQuery):
+    """Показать детальную информацию о курсе"""
+    try:
+        course_id = int(callback.data.split("_")[1])
+    except (ValueError, IndexError):
+        await callback.answer("❌ Ошибка загрузки курса", show_alert=True)
+        return
+    
+    # Ищем курс
+    course = COURSE_BY_ID.get(course_id)
+    
+    if not course:
+        await callback.answer("❌ Курс не найден", show_alert=True)
+        return
+    
+    # Регистрируем клик (заодно обновляет last_active)
+    await add_click(callback.from_user.id, course['platform'], course_id)
+    
+    platform = course['platform']
+    text = COURSE_TEXTS[course_id]
+    
+    # Клавиатура действий
+    keyboard = COURSE_DETAIL_KBS[platform]
+    
+    await edit_or_answer(callback, text, keyboard)
+    
+    await callback.answer()
+
+async def course_finder(message: Message):
+    """Подбор курса по параметрам"""
+    update_user_activity(message.from_user.id)
+    
+    await message.answer(FINDER_TEXT, reply_markup=FINDER_KB, parse_mode=ParseMode.HTML)
+
+async def my_stats(message: Message):
+    """Статистика пользователя"""
+    user_id = message.from_user.id
+    update_user_activity(user_id)
+    
+    stats = await get_user_stats(user_id)
+    
+    if not stats or not stats['user']:
+        text = "📊 <b>Ваша статистика</b>\n\nВы еще не совершали активных действий."
+    else:
+        user_data = stats['user']
+        platforms = stats['platforms_clicks']
+        
+        text = f"""
+📊 <b>Ваша статистика</b>
+
+👤 <b>Пользователь:</b> {user_data['first_name']}
+📅 <b>Зарегистрирован:</b> {user_data['registered_at'][:10]}
+🔗 <b>Ваш реф-код:</b> <code>{user_data['ref_code']}</code>
+
+📈 <b>Активность:</b>
+• Всего переходов: <b>{user_data['clicks_count']}</b>
+• Активных платформ: <b>{len(platforms)}</b>
+
+<b>Переходы по платформам:</b>
+"""
+        
+        for platform in platforms:
+            platform_name = PLATFORM_NAMES.get(platform['platform'], platform['platform'])
+            text += f"• {platform_name}: {platform['clicks']} переходов\n"
+        
+        if user_data['referrer_id']:
+            text += f"\n🤝 <b>Вас пригласил:</b> пользователь #{user_data['referrer_id']}"
+        
+        text += f"""
+
+💼 <b>Ваш заработок:</b>
+Приглашено друзей: <b>0</b>
+Доступно к выводу: <b>0 ₽</b>
+
+<i>Приглашайте друзей по реферальной ссылке!</i>
+"""
+    
+    await message.answer(text, reply_markup=STATS_KB, parse_mode=ParseMode.HTML)
+
+async def about_bot(message: Message):
+    """Информация о боте"""
+    update_user_activity(message.from_user.id)
+    
+    await message.answer(ABOUT_TEXT, reply_markup=ABOUT_KB, parse_mode=ParseMode.HTML)
+
+async def partner_program(message: Message):
+    """Партнерская программа"""
+    user_id = message.from_user.id
+    update_user_activity(user_id)
+    
+    stats = await get_user_stats(user_id)
+    ref_code = stats['user']['ref_code'] if stats and stats['user'] else "Ошибка"
+    
+    text = PARTNER_TEMPLATE.format(
+        bot_username=BOT_USERNAME,
+        user_id=message.from_user.id,
+        ref_code=ref_code
+    )
+    
+    await message.answer(text, reply_markup=PARTNER_KB, parse_mode=ParseMode.HTML)
 
 @dp.callback_query(F.data == "menu_back")
 async def back_to_menu(callback: types.CallbackQuery):
     """Возврат в главное меню"""
-    await start_command(callback.message)
+    # Пользователь уже есть в БД — только показываем меню
+    first_name = callback.from_user.first_name or "Пользователь"
+    await callback.message.answer(
+        WELCOME_TEMPLATE.format(first_name=first_name),
+        reply_markup=MAIN_MENU_KB,
+        parse_mode=ParseMode.HTML
+    )
     await callback.answer()
 
 @dp.callback_query(F.data == "category_back")
 async def back_to_categories(callback: types.CallbackQuery):
     """Возврат к категориям"""
-    text = "👇 <b>Выберите категорию курсов:</b>"
-    
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [
-                KeyboardButton(text="💻 Программирование"),
-                KeyboardButton(text="🎨 Дизайн")
-            ],
-            [
-                KeyboardButton(text="📈 Маркетинг"),
-                KeyboardButton(text="📊 Аналитика")
-            ]
-        ],
-        resize_keyboard=True
-    )
-    
-    await callback.message.answer(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+    await callback.message.answer(CATEGORIES_TEXT, reply_markup=CATEGORIES_KB, parse_mode=ParseMode.HTML)
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("similar_"))
@@ -841,11 +1043,7 @@ async def show_similar_courses(callback: types.CallbackQuery):
         return
     
     # Ищем курсы этой платформы
-    similar_courses = []
-    for category in COURSES_DATA.values():
-        for course in category:
-            if course['platform'] == platform:
-                similar_courses.append(course)
+    similar_courses = COURSES_BY_PLATFORM.get(platform, [])
     
     if not similar_courses:
         await callback.answer("😔 Похожие курсы не найдены", show_alert=True)
@@ -854,33 +1052,16 @@ async def show_similar_courses(callback: types.CallbackQuery):
     platform_name = PLATFORM_NAMES.get(platform, platform)
     text = f"<b>Другие курсы на {platform_name}:</b>\n\n"
     
-    keyboard_buttons = []
-    for course in similar_courses[:5]:  # Ограничиваем 5 курсами
-        keyboard_buttons.append([
-            InlineKeyboardButton(
-                text=course['title'],
-                callback_data=f"course_{course['id']}"
-            )
-        ])
-    
-    keyboard_buttons.append([
-        InlineKeyboardButton(text="🔙 Назад", callback_data="menu_back")
-    ])
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+    keyboard = SIMILAR_KBS[platform]
     
-    try:
-        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-    except:
-        await callback.message.answer(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+    await edit_or_answer(callback, text, keyboard)
     
     await callback.answer()
 
 @dp.callback_query(F.data == "my_ref_link")
 async def show_ref_link(callback: types.CallbackQuery):
     """Показать реферальную ссылку"""
-    bot_username = (await bot.get_me()).username
-    ref_link = f"https://t.me/{bot_username}?start=ref{callback.from_user.id}"
+    ref_link = f"https://t.me/{BOT_USERNAME}?start=ref{callback.from_user.id}"
     
     text = f"""
 <b>Ваша реферальная ссылка:</b>
@@ -897,15 +1078,10 @@ async def show_ref_link(callback: types.CallbackQuery):
                 url=f"https://t.me/share/url?url={ref_link}&text=Привет! Нашел классного бота с курсами по IT!"
             )
         ],
-        [
-            InlineKeyboardButton(text="🔙 Назад", callback_data="menu_back")
-        ]
+        BACK_TO_MENU_ROW
     ])
     
-    try:
-        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-    except:
-        await callback.message.answer(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+    await edit_or_answer(callback, text, keyboard)
     
     await callback.answer("Ссылка готова!")
 
@@ -921,92 +1097,111 @@ async def stats_command(message: Message):
     """Команда статистики"""
     await my_stats(message)
 
+async def _run_admin_queries() -> str:
+    """Сбор общей статистики и сборка текста админ-панели"""
+    async with pool.connection() as conn:
+        # Общая статистика одним запросом
+        totals = await conn.execute_fetchall('''
+            SELECT (SELECT COUNT(*) FROM users) as total_users,
+                   (SELECT COUNT(*) FROM clicks) as total_clicks,
+                   (SELECT COUNT(*) FROM users
+                    WHERE last_active > datetime('now', '-7 days')) as active_users
+        ''')
+        total_users, total_clicks, active_users = totals[0]
+        
+        parts = [
+            ADMIN_HEADER,
+            f"👥 <b>Пользователи:</b> {total_users}\n"
+            f"📈 <b>Активные (7 дней):</b> {active_users}\n"
+            f"🖱️ <b>Всего кликов:</b> {total_clicks}\n",
+            ADMIN_PLATFORMS_HEADER
+        ]
+        
+        # Строки курсора сразу превращаем в текст, не накапливая списки.
+        # Названия из БД экранируем, известные платформы уже экранированы
+        platform_name = PLATFORM_NAMES_HTML.get
+        async with conn.execute('''
+            SELECT platform, COUNT(*) as clicks
+            FROM clicks
+            GROUP BY platform
+            ORDER BY clicks DESC
+        ''') as cursor:
+            async for platform, clicks in cursor:
+                parts.append(f"• {platform_name(platform) or html.escape(platform)}: {clicks}\n")
+        
+        parts.append(ADMIN_DAILY_HEADER)
+        async with conn.execute('''
+            SELECT click_date as date, COUNT(*) as clicks
+            FROM clicks
+            WHERE click_date > date('now', '-7 days')
+            GROUP BY click_date
+            ORDER BY click_date DESC
+        ''') as cursor:
+            async for date, clicks in cursor:
+                parts.append(f"• {date}: {clicks}\n")
+    
+    parts.append(f"\n<i>Обновлено: {datetime.now().strftime('%d.%m.%Y %H:%M')}</i>")
+    
+    return "".join(parts)
+
+# Кеш текста админ-панели
+ADMIN_STATS_TTL = 60
+_ADMIN_STATS_CACHE = {"ts": 0.0, "text": None}
+
+async def render_admin_panel(ttl: float = ADMIN_STATS_TTL) -> str:
+    """Текст админ-панели с кешированием на ttl секунд"""
+    if _ADMIN_STATS_CACHE["text"] is None or time.monotonic() - _ADMIN_STATS_CACHE["ts"] >= ttl:
+        # Время обновления форматируется один раз на заполнение кеша
+        _ADMIN_STATS_CACHE["text"] = await _run_admin_queries()
+        _ADMIN_STATS_CACHE["ts"] = time.monotonic()
+    return _ADMIN_STATS_CACHE["text"]
+
 # Команда /admin для администратора
 @dp.message(Command("admin"))
 async def admin_panel(message: Message):
     """Админ-панель"""
-    ADMIN_IDS = [int(os.getenv("ADMIN_ID", "0"))]  # Ваш ID из .env
-    
     if message.from_user.id not in ADMIN_IDS:
         await message.answer("⛔ Доступ запрещен")
         return
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Общая статистика
-    cursor.execute('SELECT COUNT(*) as total FROM users')
-    total_users = cursor.fetchone()['total']
+    text = await render_admin_panel()
     
-    cursor.execute('SELECT COUNT(*) as total FROM clicks')
-    total_clicks = cursor.fetchone()['total']
-    
-    cursor.execute('''
-        SELECT COUNT(DISTINCT telegram_id) as active 
-        FROM users 
-        WHERE last_active > datetime('now', '-7 days')
-    ''')
-    active_users = cursor.fetchone()['active']
-    
-    cursor.execute('''
-        SELECT platform, COUNT(*) as clicks
-        FROM clicks
-        GROUP BY platform
-        ORDER BY clicks DESC
-    ''')
-    platform_stats = cursor.fetchall()
+    await message.answer(text, reply_markup=ADMIN_KB, parse_mode=ParseMode.HTML)
+
+@dp.callback_query(F.data == "admin_refresh")
+async def admin_refresh(callback: types.CallbackQuery):
+    """Принудительное обновление админ-панели"""
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("⛔ Доступ запрещен", show_alert=True)
+        return
     
-    cursor.execute('''
-        SELECT DATE(clicked_at) as date, COUNT(*) as clicks
-        FROM clicks
-        WHERE clicked_at > datetime('now', '-7 days')
-        GROUP BY DATE(clicked_at)
-        ORDER BY date DESC
-    ''')
-    daily_stats = cursor.fetchall()
+    # Сбрасываем кеш агрегатов
+    _ADMIN_STATS_CACHE["ts"] = 0.0
+    text = await render_admin_panel()
     
-    conn.close()
+    await edit_or_answer(callback, text, ADMIN_KB)
     
-    text = f"""
-<b>📊 АДМИН-ПАНЕЛЬ</b>
+    await callback.answer("✅ Статистика обновлена")
 
-👥 <b>Пользователи:</b> {total_users}
-📈 <b>Активные (7 дней):</b> {active_users}
-🖱️ <b>Всего кликов:</b> {total_clicks}
+# Кнопки главного меню: текст кнопки -> обработчик
+TEXT_HANDLERS = {
+    "💻 Программирование": partial(show_category, category='programming'),
+    "🎨 Дизайн": partial(show_category, category='design'),
+    "📈 Маркетинг": partial(show_category, category='marketing'),
+    "📊 Аналитика": partial(show_category, category='analytics'),
+    "🔍 Подобрать курс": course_finder,
+    "📊 Моя статистика": my_stats,
+    "ℹ️ О боте": about_bot,
+    "🤝 Партнерка": partner_program,
+}
 
-<b>Клики по платформам:</b>
-"""
-    
-    for stat in platform_stats:
-        platform_name = PLATFORM_NAMES.get(stat['platform'], stat['platform'])
-        text += f"• {platform_name}: {stat['clicks']}\n"
-    
-    text += f"\n<b>Клики за 7 дней:</b>\n"
-    for stat in daily_stats:
-        text += f"• {stat['date']}: {stat['clicks']}\n"
-    
-    text += f"\n<i>Обновлено: {datetime.now().strftime('%d.%m.%Y %H:%M')}</i>"
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_refresh"),
-            InlineKeyboardButton(text="📥 Экспорт", callback_data="admin_export")
-        ],
-        [
-            InlineKeyboardButton(text="✉️ Рассылка", callback_data="admin_broadcast"),
-            InlineKeyboardButton(text="🚪 Выход", callback_data="menu_back")
-        ]
-    ])
-    
-    await message.answer(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+@dp.message(F.text.in_(TEXT_HANDLERS))
+async def menu_button(message: Message):
+    """Обработка кнопок главного меню"""
+    await TEXT_HANDLERS[message.text](message)
 
 # Обработка неизвестных сообщений
-@dp.message()
-async def handle_unknown(message: Message):
-    """Обработка неизвестных сообщений"""
-    update_user_activity(message.from_user.id)
-    
-    response = """
+UNKNOWN_RESPONSE = """
 🤔 Я не понимаю это сообщение.
 
 Используйте кнопки меню или команды:
@@ -1014,18 +1209,36 @@ async def handle_unknown(message: Message):
 /help — Помощь по боту
 /stats — Ваша статистика
     """
+
+# Минимальный интервал между ответами на непонятные сообщения (секунды)
+UNKNOWN_REPLY_INTERVAL = 3
+UNKNOWN_REPLY_CACHE_SIZE = 10000
+_last_unknown_reply = OrderedDict()
+
+@dp.message()
+async def handle_unknown(message: Message):
+    """Обработка неизвестных сообщений"""
+    user_id = message.from_user.id
+    update_user_activity(user_id)
     
-    await message.answer(response)
+    # На поток непонятных сообщений отвечаем не чаще раза в несколько секунд
+    now = time.monotonic()
+    if now - _last_unknown_reply.get(user_id, float('-inf')) < UNKNOWN_REPLY_INTERVAL:
+        return
+    _last_unknown_reply[user_id] = now
+    _last_unknown_reply.move_to_end(user_id)
+    # Самые старые отметки вытесняем, чтобы словарь не рос бесконечно
+    while len(_last_unknown_reply) > UNKNOWN_REPLY_CACHE_SIZE:
+        _last_unknown_reply.popitem(last=False)
+    
+    await message.answer(UNKNOWN_RESPONSE)
 
 async def main():
     """Главная функция"""
-    # Инициализация БД
-    init_db()
-    
     logger.info("=" * 50)
     logger.info("БОТ ЗАПУЩЕН")
-    logger.info(f"Платформы: {', '.join(PARTNER_LINKS.keys())}")
-    logger.info(f"Количество курсов: {sum(len(c) for c in COURSES_DATA.values())}")
+    logger.info("Платформы: %s", ', '.join(PARTNER_LINKS.keys()))
+    logger.info("Количество курсов: %s", sum(len(c) for c in COURSES_DATA.values()))
     logger.info("=" * 50)
     
     # Запуск бота
@@ -2,7 +2,4 @@
 users: id, telegram_id, username, first_name, last_name, registered_at, clicks_count, ref_code, referrer_id, last_active
 
 -- Клики
-clicks: id, user_id, platform, course_id, clicked_at
-
--- Кэш курсов
-courses_cache: id, title, platform, category, data, updated_at
\ No newline at end of file
+clicks: id, user_id, platform, course_id, clicked_at, click_date (DATE(clicked_at), virtual)
\ No newline at end of file